@@ -1,3 +1,5 @@
 __version__ = '0.1.2'
 from .utils import *
+from .export import *
 from .score import *
+from .significance import *
@@ -0,0 +1,192 @@
+import os
+import torch
+
+__all__ = ['backends', 'export_encoder', 'load_exported_encoder', 'check_parity']
+
+backends = ['eager', 'torchscript', 'onnx']
+
+default_cache_dir = os.getenv('BERT_SCORE_CACHE',
+                              os.path.join(os.path.expanduser('~'), '.cache', 'bert_score'))
+
+
+class _TruncatedEncoder(torch.nn.Module):
+    """Exposes the last kept layer of a `BertModel` as a plain tensor function."""
+
+    def __init__(self, model):
+        super(_TruncatedEncoder, self).__init__()
+        self.model = model
+
+    def forward(self, x, attention_mask):
+        x_seg = torch.zeros_like(x)
+        encoded_layers, _ = self.model(x, x_seg, attention_mask=attention_mask,
+                                       output_all_encoded_layers=False)
+        return encoded_layers
+
+
+class ExportedEncoder(object):
+    """
+    Runs an exported encoder behind the `BertModel` call signature used by
+    `bert_encode`, so it can be passed anywhere a model is expected. Exported
+    encoders always run on CPU; outputs are moved back to the input device.
+    """
+
+    def __init__(self, run):
+        self.run = run
+
+    def eval(self):
+        return self
+
+    def __call__(self, x, token_type_ids=None, attention_mask=None,
+                 output_all_encoded_layers=False):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(x)
+        out = self.run(x.cpu(), attention_mask.cpu())
+        return out.to(x.device), None
+
+
+def _cache_path(bert, num_layers, backend, cache_dir):
+    # graphs are tied to the torch version that traced them
+    ext = '.onnx' if backend == 'onnx' else '.pt'
+    return os.path.join(cache_dir, '{}_L{}_torch-{}{}'.format(bert, num_layers,
+                                                              torch.__version__, ext))
+
+
+def _example_inputs(model, batch_size, seq_len):
+    vocab_size = model.embeddings.word_embeddings.num_embeddings
+    x = torch.randint(1, vocab_size, (batch_size, seq_len), dtype=torch.long)
+    mask = torch.ones(batch_size, seq_len, dtype=torch.long)
+    mask[0, seq_len // 2:] = 0
+    return x, mask
+
+
+def check_parity(model, exported, shapes=((1, 5), (3, 11), (4, 32)), atol=1e-4):
+    """
+    Compare an exported encoder with the eager `model` on random inputs and
+    raise a `RuntimeError` if they disagree.
+
+    Args:
+        - :param: `model` : the BERT model from `pytorch_pretrained_bert`
+                  that was exported, on CPU.
+        - :param: `exported` (ExportedEncoder): the exported encoder
+        - :param: `shapes` (list of tuple): (batch size, sequence length) of
+                  the inputs to compare on
+        - :param: `atol` (float): largest allowed absolute difference
+    """
+    eager = _TruncatedEncoder(model).eval()
+    for batch_size, seq_len in shapes:
+        x, mask = _example_inputs(model, batch_size, seq_len)
+        with torch.no_grad():
+            expected = eager(x, mask)
+        actual = exported(x, attention_mask=mask)[0]
+        diff = (expected - actual).abs().max().item()
+        if diff > atol:
+            raise RuntimeError('exported encoder differs from the eager model on a '
+                               '{}x{} batch (max abs diff {:.2e} > {:.0e})'.format(
+                                   batch_size, seq_len, diff, atol))
+
+
+def _load(path, backend):
+    if backend == 'torchscript':
+        module = torch.jit.load(path, map_location='cpu')
+        module.eval()
+
+        def run(x, attention_mask):
+            with torch.no_grad():
+                return module(x, attention_mask)
+        return ExportedEncoder(run)
+
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError('the onnx backend requires onnxruntime, '
+                          'install it with `pip install onnxruntime`')
+    session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+
+    def run(x, attention_mask):
+        out = session.run(None, {'input_ids': x.numpy(),
+                                 'attention_mask': attention_mask.numpy()})[0]
+        return torch.from_numpy(out)
+    return ExportedEncoder(run)
+
+
+def export_encoder(model, bert, num_layers, backend='torchscript',
+                   cache_dir=default_cache_dir, verify=True):
+    """
+    Export a truncated BERT encoder to a TorchScript or ONNX graph with
+    dynamic batch and sequence axes, and cache it on disk.
+
+    Returns the path of the exported graph.
+
+    Args:
+        - :param: `model` : a BERT model from `pytorch_pretrained_bert` with
+                  its layers already truncated to `num_layers`.
+        - :param: `bert` (str): bert specification, used in the cache name
+        - :param: `num_layers` (int): the layer of representation to use
+        - :param: `backend` (str): 'torchscript' or 'onnx'
+        - :param: `cache_dir` (str): directory of the exported graphs
+        - :param: `verify` (bool): compare the export against `model`
+    """
+    assert backend in backends and backend != 'eager'
+    assert next(model.parameters()).device.type == 'cpu', \
+        "exported encoders run on CPU, load the model with device='cpu'"
+
+    path = _cache_path(bert, num_layers, backend, cache_dir)
+    if os.path.isfile(path):
+        return path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    eager = _TruncatedEncoder(model).eval()
+    example = _example_inputs(model, 2, 8)
+    tmp_path = path + '.tmp'
+
+    try:
+        with torch.no_grad():
+            if backend == 'torchscript':
+                traced = torch.jit.trace(eager, example)
+                traced.save(tmp_path)
+            else:
+                torch.onnx.export(eager, example, tmp_path,
+                                  input_names=['input_ids', 'attention_mask'],
+                                  output_names=['encoded_layer'],
+                                  dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'},
+                                                'attention_mask': {0: 'batch', 1: 'sequence'},
+                                                'encoded_layer': {0: 'batch', 1: 'sequence'}})
+        if verify:
+            check_parity(model, _load(tmp_path, backend))
+    except Exception:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    # only publish the graph once it is complete and verified
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_exported_encoder(model, bert, num_layers, backend='torchscript',
+                          cache_dir=default_cache_dir):
+    """
+    Load the exported encoder for `bert` and `num_layers`, exporting `model`
+    first if it is not cached yet. A cached graph is checked against `model`
+    and exported again if it disagrees.
+
+    Args:
+        - :param: `model` : a BERT model from `pytorch_pretrained_bert` on
+                  CPU, with its layers already truncated to `num_layers`.
+        - :param: `bert` (str): bert specification
+        - :param: `num_layers` (int): the layer of representation to use
+        - :param: `backend` (str): 'torchscript' or 'onnx'
+        - :param: `cache_dir` (str): directory of the exported graphs
+    """
+    cached = os.path.isfile(_cache_path(bert, num_layers, backend, cache_dir))
+    path = export_encoder(model, bert, num_layers, backend=backend, cache_dir=cache_dir)
+    encoder = _load(path, backend)
+    if cached:
+        try:
+            check_parity(model, encoder)
+        except RuntimeError:
+            # stale graph, e.g. exported from different weights
+            os.remove(path)
+            path = export_encoder(model, bert, num_layers, backend=backend, cache_dir=cache_dir)
+            encoder = _load(path, backend)
+    return encoder
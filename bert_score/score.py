@@ -1,51 +1,128 @@
 import os
+import json
 import time
 import argparse
 import torch
+from multiprocessing import Pool
 from collections import defaultdict
 from pytorch_pretrained_bert import BertTokenizer, BertModel, BertForMaskedLM
 from sacremoses import MosesTokenizer, MosesPunctNormalizer
 import matplotlib
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import numpy as np
+from tqdm.auto import tqdm
 
 from .utils import get_idf_dict, bert_cos_score_idf,\
                    get_bert_embedding, bert_types
+from .export import load_exported_encoder, backends
 
-__all__ = ['score', 'plot_example']
+__all__ = ['score', 'score_systems', 'plot_example', 'load_bert', 'get_sim_matrices', 'annotate_modes',
+           'save_sim_matrices', 'plot_examples']
 
-def score(cands, refs, cands_lang, refs_lang, bert="bert-base-multilingual-cased",
-          num_layers=8, verbose=False, no_idf=False, batch_size=64):
+annotate_modes = ['all', 'aligned', 'none']
+
+
+def load_bert(bert, num_layers, device):
+    """
+    Load a BERT tokenizer and model with only the first `num_layers` layers.
+
+    Args:
+        - :param: `bert` (str): bert specification
+        - :param: `num_layers` (int): the layer of representation to use
+        - :param: `device` (str): device to use, e.g. 'cpu' or 'cuda'
+    """
+    tokenizer = BertTokenizer.from_pretrained(bert)
+    model = BertModel.from_pretrained(bert)
+    model.eval()
+    model.to(device)
+
+    # drop unused layers
+    model.encoder.layer = torch.nn.ModuleList([layer for layer in model.encoder.layer[:int(num_layers)]])
+    return tokenizer, model
+
+
+def score(cands, refs, cands_lang=None, refs_lang=None, bert="bert-base-multilingual-cased",
+          num_layers=8, verbose=False, no_idf=False, batch_size=64, backend='eager',
+          mem_budget=None):
     """
     BERTScore metric.
 
     Args:
         - :param: `cands` (list of str): candidate sentences
         - :param: `refs` (list of str): reference sentences
+        - :param: `cands_lang` (list of str): candidate languages, only used by facebook-XLM
+        - :param: `refs_lang` (list of str): reference languages, only used by facebook-XLM
         - :param: `bert` (str): bert specification
         - :param: `num_layers` (int): the layer of representation to use
         - :param: `verbose` (bool): turn on intermediate status update
         - :param: `no_idf` (bool): do not use idf weighting
-        - :param: `batch_size` (int): bert score processing batch size
+        - :param: `batch_size` (int or 'auto'): bert score processing batch size,
+                  'auto' sizes batches from available memory and retries on
+                  out-of-memory errors
+        - :param: `backend` (str): 'eager', or run the truncated encoder on CPU
+                  through a cached 'torchscript' or 'onnx' export
+        - :param: `mem_budget` (int): largest number of bytes a batch may use
+                  with `batch_size='auto'`, CUDA only (default: 90% of the
+                  free memory)
     """
-    assert len(cands) == len(refs)
+    return score_systems([cands], refs, cands_lang=cands_lang, refs_lang=refs_lang, bert=bert,
+                         num_layers=num_layers, verbose=verbose, no_idf=no_idf,
+                         batch_size=batch_size, backend=backend, mem_budget=mem_budget)[0]
+
+
+def score_systems(all_cands, refs, cands_lang=None, refs_lang=None,
+                  bert="bert-base-multilingual-cased", num_layers=8, verbose=False,
+                  no_idf=False, batch_size=64, backend='eager', mem_budget=None):
+    """
+    BERTScore of several systems against the same references, computing the
+    idf weights only once. BERT models are also loaded only once; the
+    facebook-XLM model is still loaded for every system by
+    `bert_cos_score_idf`.
+
+    Returns one (P, R, F1) tuple per system, as `score` does.
+
+    Args:
+        - :param: `all_cands` (list of list of str): candidate sentences of
+                  each system
+        - :param: `refs` (list of str): reference sentences
+        - :param: `cands_lang` (list of str): candidate languages, only used by facebook-XLM
+        - :param: `refs_lang` (list of str): reference languages, only used by facebook-XLM
+        - :param: `bert` (str): bert specification
+        - :param: `num_layers` (int): the layer of representation to use
+        - :param: `verbose` (bool): turn on intermediate status update
+        - :param: `no_idf` (bool): do not use idf weighting
+        - :param: `batch_size` (int or 'auto'): bert score processing batch size,
+                  'auto' sizes batches from available memory and retries on
+                  out-of-memory errors
+        - :param: `backend` (str): 'eager', or run the truncated encoder on CPU
+                  through a cached 'torchscript' or 'onnx' export
+        - :param: `mem_budget` (int): largest number of bytes a batch may use
+                  with `batch_size='auto'`, CUDA only (default: 90% of the
+                  free memory)
+    """
+    assert all(len(cands) == len(refs) for cands in all_cands)
     assert bert in bert_types
+    assert backend in backends
 
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    if backend != 'eager':
+        # exported encoders are for CPU inference
+        device = 'cpu'
 
     if bert == 'facebook-XLM':
         model = None
         tokenizer = None #MosesTokenizer(lang = refs_lang[0])
         XLM = True
     else:
-        tokenizer = BertTokenizer.from_pretrained(bert)
-        model = BertModel.from_pretrained(bert)
-        model.eval()
-        model.to(device)
+        tokenizer, model = load_bert(bert, num_layers, device)
         XLM = False
 
-        # drop unused layers
-        model.encoder.layer = torch.nn.ModuleList([layer for layer in model.encoder.layer[:num_layers]])
+        if backend != 'eager':
+            if verbose:
+                print('loading {} encoder...'.format(backend))
+            model = load_exported_encoder(model, bert, num_layers, backend=backend)
     
     if no_idf:
         idf_dict = defaultdict(lambda: 1.)
@@ -60,69 +137,130 @@ def score(cands, refs, cands_lang, refs_lang, bert="bert-base-multilingual-cased
         if verbose:
             print('done in {:.2f} seconds'.format(time.perf_counter() - start))
     
-    if verbose:
-        print('calculating scores...')
-    start = time.perf_counter()
-    all_preds = bert_cos_score_idf(model, refs, cands, refs_lang, cands_lang, tokenizer, idf_dict, bert,
-                                   verbose=verbose, device=device, batch_size=batch_size)
+    results = []
+    for cands in all_cands:
+        if verbose:
+            print('calculating scores...')
+        start = time.perf_counter()
+        all_preds = bert_cos_score_idf(model, refs, cands, refs_lang, cands_lang, tokenizer, idf_dict, bert,
+                                       verbose=verbose, device=device, batch_size=batch_size,
+                                       mem_budget=mem_budget)
 
-    P = all_preds[:, 0].cpu()
-    R = all_preds[:, 1].cpu()
-    F1 = all_preds[:, 2].cpu()
+        P = all_preds[:, 0].cpu()
+        R = all_preds[:, 1].cpu()
+        F1 = all_preds[:, 2].cpu()
 
-    if verbose:
-        print('done in {:.2f} seconds'.format(time.perf_counter() - start))
+        if verbose:
+            print('done in {:.2f} seconds'.format(time.perf_counter() - start))
+        results.append((P, R, F1))
 
-    return P, R, F1
+    return results
 
-def plot_example(h, r, verbose=False, bert="bert-base-multilingual-cased",
-                 num_layers=8, fname=''):
+def get_sim_matrices(cands, refs, model, tokenizer, batch_size=64, device='cuda:0',
+                     verbose=False):
     """
-    BERTScore metric.
+    Compute token-level cosine similarity matrices for many pairs with a
+    shared model.
+
+    Returns a list with one dict per pair holding the candidate and reference
+    word pieces (`h_tokens`, `r_tokens`), the similarity matrix `sim`
+    (len(h_tokens) x len(r_tokens), [CLS] and [SEP] removed), the greedy
+    alignments `h_align` / `r_align` (index of the best matching token on the
+    other side) and the unweighted `P`, `R` and `F`.
 
     Args:
-        - :param: `h` (str): a candidate sentence
-        - :param: `r` (str): a reference sentence
+        - :param: `cands` (list of str): candidate sentences
+        - :param: `refs` (list of str): reference sentences
+        - :param: `model` : a BERT model from `pytorch_pretrained_bert`.
+        - :param: `tokenizer` : a BERT tokenizer corresponds to `model`.
+        - :param: `batch_size` (int): number of pairs encoded at once
+        - :param: `device` (str): device to use, e.g. 'cpu' or 'cuda'
         - :param: `verbose` (bool): turn on intermediate status update
-        - :param: `bert` (str): bert specification
-        - :param: `num_layers` (int): the layer of representation to use
     """
-    assert bert in bert_types
+    assert len(cands) == len(refs)
 
-    if verbose:
-        print('loading BERT model...')
-    tokenizer = BertTokenizer.from_pretrained(bert)
-    model = BertModel.from_pretrained(bert)
-    model.eval()
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    model.to(device)
+    idf_dict = defaultdict(lambda: 1.)
+    examples = []
+    iter_range = range(0, len(refs), batch_size)
+    if verbose: iter_range = tqdm(iter_range)
 
-    h_tokens = ['[CLS]'] + tokenizer.tokenize(h) + ['[SEP]']
-    r_tokens = ['[CLS]'] + tokenizer.tokenize(r) + ['[SEP]']
+    for batch_start in iter_range:
+        batch_refs = refs[batch_start:batch_start+batch_size]
+        batch_hyps = cands[batch_start:batch_start+batch_size]
 
-    model.encoder.layer = torch.nn.ModuleList([layer for layer in model.encoder.layer[:num_layers]])
-    idf_dict = defaultdict(lambda: 1.)
+        # tokenize once and reuse the word pieces for the figure labels
+        r_tokens = [tokenizer.tokenize(r) for r in batch_refs]
+        h_tokens = [tokenizer.tokenize(h) for h in batch_hyps]
+
+        ref_embedding, ref_lens, _, _ = get_bert_embedding(r_tokens, model, tokenizer, idf_dict,
+                                                           device=device, tokenize=list)
+        hyp_embedding, hyp_lens, _, _ = get_bert_embedding(h_tokens, model, tokenizer, idf_dict,
+                                                           device=device, tokenize=list)
+
+        ref_embedding.div_(torch.norm(ref_embedding, dim=-1).unsqueeze(-1))
+        hyp_embedding.div_(torch.norm(hyp_embedding, dim=-1).unsqueeze(-1))
+
+        sims = torch.bmm(hyp_embedding, ref_embedding.transpose(1, 2)).cpu().numpy()
+        ref_lens = ref_lens.cpu().tolist()
+        hyp_lens = hyp_lens.cpu().tolist()
 
-    ref_embedding, ref_lens, ref_masks, padded_idf = get_bert_embedding([r], model, tokenizer, idf_dict,
-                                       device=device)
-    hyp_embedding, ref_lens, ref_masks, padded_idf = get_bert_embedding([h], model, tokenizer, idf_dict,
-                                       device=device)
+        for i in range(len(batch_hyps)):
+            # remove [CLS] and [SEP] tokens
+            sim = sims[i, 1:hyp_lens[i]-1, 1:ref_lens[i]-1]
+            if sim.size == 0:
+                precision = recall = np.zeros(0, dtype=sim.dtype)
+                h_align = r_align = np.zeros(0, dtype=np.int64)
+            else:
+                precision, h_align = sim.max(1), sim.argmax(1)
+                recall, r_align = sim.max(0), sim.argmax(0)
+            P = float(precision.mean()) if precision.size else 0.
+            R = float(recall.mean()) if recall.size else 0.
+            F = 2 * P * R / (P + R) if P + R > 0 else 0.
+            examples.append({
+                'h_tokens': h_tokens[i],
+                'r_tokens': r_tokens[i],
+                'sim': sim,
+                'h_align': h_align,
+                'r_align': r_align,
+                'P': P,
+                'R': R,
+                'F': F,
+            })
 
-    ref_embedding.div_(torch.norm(ref_embedding, dim=-1).unsqueeze(-1))
-    hyp_embedding.div_(torch.norm(hyp_embedding, dim=-1).unsqueeze(-1))
+    return examples
 
-    batch_size = ref_embedding.size(1)
 
-    sim = torch.bmm(hyp_embedding, ref_embedding.transpose(1, 2)).cpu()
-    sim = sim.squeeze(0).numpy()
+def save_sim_matrices(examples, fname):
+    """
+    Save the output of `get_sim_matrices` as `fname.npz` (similarity
+    matrices `sim_<i>` and score arrays `P`, `R`, `F`) and `fname.json`
+    (tokens, alignments and scores of each pair).
+
+    Args:
+        - :param: `examples` (list of dict): output of `get_sim_matrices`
+        - :param: `fname` (str): output path without extension
+    """
+    arrays = {'sim_{}'.format(i): ex['sim'] for i, ex in enumerate(examples)}
+    for key in ('P', 'R', 'F'):
+        arrays[key] = np.array([ex[key] for ex in examples], dtype=np.float32)
+    np.savez_compressed(fname + '.npz', **arrays)
 
-    # remove [CLS] and [SEP] tokens 
-    r_tokens = r_tokens[1:-1]
-    h_tokens = h_tokens[1:-1]
-    sim = sim[1:-1,1:-1]
+    records = [{
+        'h_tokens': ex['h_tokens'],
+        'r_tokens': ex['r_tokens'],
+        'h_align': ex['h_align'].tolist(),
+        'r_align': ex['r_align'].tolist(),
+        'P': ex['P'],
+        'R': ex['R'],
+        'F': ex['F'],
+    } for ex in examples]
+    with open(fname + '.json', 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False)
 
-    fig, ax = plt.subplots(figsize=(len(r_tokens)*0.8, len(h_tokens)*0.8))
-    im = ax.imshow(sim, cmap='Blues')
+
+def _draw_sim(fig, sim, h_tokens, r_tokens, annotate='all'):
+    ax = fig.add_subplot(111)
+    ax.imshow(sim, cmap='Blues')
 
     # We want to show all ticks...
     ax.set_xticks(np.arange(len(r_tokens)))
@@ -130,24 +268,134 @@ def plot_example(h, r, verbose=False, bert="bert-base-multilingual-cased",
     # ... and label them with the respective list entries
     ax.set_xticklabels(r_tokens, fontsize=10)
     ax.set_yticklabels(h_tokens, fontsize=10)
-    plt.xlabel("Refernce", fontsize=10)
-    plt.ylabel("Candidate", fontsize=10)
+    ax.set_xlabel("Refernce", fontsize=10)
+    ax.set_ylabel("Candidate", fontsize=10)
 
     # Rotate the tick labels and set their alignment.
-    plt.setp(ax.get_xticklabels(), rotation=45, ha="right",
-             rotation_mode="anchor")
-
-    # Loop over data dimensions and create text annotations.
-    for i in range(len(h_tokens)):
-        for j in range(len(r_tokens)):
-            text = ax.text(j, i, '{:.3f}'.format(sim[i, j]),
-                           ha="center", va="center", color="k" if sim[i, j] < 0.6 else "w")
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_ha("right")
+        label.set_rotation_mode("anchor")
 
-#     P = sim.max(1).mean()
-#     R = sim.max(0).mean()
-#     F1 = 2 * P * R / (P + R)
+    # every annotation is a separate text artist, so 'all' is slow for long
+    # sentences while 'aligned' only labels the greedy match of each
+    # candidate token
+    if annotate == 'all':
+        cells = np.ndindex(*sim.shape)
+    elif annotate == 'aligned' and sim.size > 0:
+        cells = enumerate(sim.argmax(1))
+    else:
+        cells = ()
+    for i, j in cells:
+        ax.text(j, i, '{:.3f}'.format(sim[i, j]),
+                ha="center", va="center", color="k" if sim[i, j] < 0.6 else "w")
 
     fig.tight_layout()
+    return ax
+
+
+def _render_sim(args):
+    sim, h_tokens, r_tokens, fname, annotate = args
+    # draw on a bare Agg canvas so workers never touch the pyplot state
+    fig = Figure(figsize=(max(len(r_tokens), 1)*0.8, max(len(h_tokens), 1)*0.8))
+    FigureCanvasAgg(fig)
+    _draw_sim(fig, sim, h_tokens, r_tokens, annotate=annotate)
+    fig.savefig(fname, dpi=100)
+    return fname
+
+
+def plot_examples(cands, refs, verbose=False, bert="bert-base-multilingual-cased",
+                  num_layers=8, batch_size=64, output_dir='.', render=True,
+                  annotate='none', nthreads=4):
+    """
+    Compute and export the similarity matrices of many pairs with a single
+    model load.
+
+    Writes `sim.npz` and `sim.json` (see `save_sim_matrices`) to
+    `output_dir` and, if `render` is set, one `<i>.png` heatmap per pair
+    rendered in a pool of `nthreads` processes. Returns the output of
+    `get_sim_matrices`.
+
+    Args:
+        - :param: `cands` (list of str): candidate sentences
+        - :param: `refs` (list of str): reference sentences
+        - :param: `verbose` (bool): turn on intermediate status update
+        - :param: `bert` (str): bert specification
+        - :param: `num_layers` (int): the layer of representation to use
+        - :param: `batch_size` (int): number of pairs encoded at once
+        - :param: `output_dir` (str): directory to write the outputs to
+        - :param: `render` (bool): also render a heatmap for each pair
+        - :param: `annotate` (str): write the similarity in 'all' cells, only
+                  the 'aligned' ones or 'none'
+        - :param: `nthreads` (int): number of processes used for rendering
+    """
+    assert len(cands) == len(refs)
+    assert bert in bert_types and bert != 'facebook-XLM'
+    assert annotate in annotate_modes
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    if verbose:
+        print('loading BERT model...')
+    tokenizer, model = load_bert(bert, num_layers, device)
+
+    if verbose:
+        print('calculating similarity matrices...')
+    start = time.perf_counter()
+    examples = get_sim_matrices(cands, refs, model, tokenizer, batch_size=batch_size,
+                                device=device, verbose=verbose)
+    if verbose:
+        print('done in {:.2f} seconds'.format(time.perf_counter() - start))
+
+    os.makedirs(output_dir, exist_ok=True)
+    save_sim_matrices(examples, os.path.join(output_dir, 'sim'))
+
+    if render:
+        if verbose:
+            print('rendering figures...')
+        start = time.perf_counter()
+        jobs = [(ex['sim'], ex['h_tokens'], ex['r_tokens'],
+                 os.path.join(output_dir, '{}.png'.format(i)), annotate)
+                for i, ex in enumerate(examples)]
+        if nthreads > 1:
+            with Pool(nthreads) as p:
+                p.map(_render_sim, jobs)
+        else:
+            for job in jobs:
+                _render_sim(job)
+        if verbose:
+            print('done in {:.2f} seconds'.format(time.perf_counter() - start))
+
+    return examples
+
+
+def plot_example(h, r, verbose=False, bert="bert-base-multilingual-cased",
+                 num_layers=8, fname='', annotate='all'):
+    """
+    BERTScore metric.
+
+    Args:
+        - :param: `h` (str): a candidate sentence
+        - :param: `r` (str): a reference sentence
+        - :param: `verbose` (bool): turn on intermediate status update
+        - :param: `bert` (str): bert specification
+        - :param: `num_layers` (int): the layer of representation to use
+        - :param: `annotate` (str): write the similarity in 'all' cells, only
+                  the 'aligned' ones or 'none'
+    """
+    assert bert in bert_types
+    assert annotate in annotate_modes
+
+    if verbose:
+        print('loading BERT model...')
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    tokenizer, model = load_bert(bert, num_layers, device)
+
+    ex = get_sim_matrices([h], [r], model, tokenizer, device=device)[0]
+    sim, h_tokens, r_tokens = ex['sim'], ex['h_tokens'], ex['r_tokens']
+
+    fig = plt.figure(figsize=(len(r_tokens)*0.8, len(h_tokens)*0.8))
+    _draw_sim(fig, sim, h_tokens, r_tokens, annotate=annotate)
+
 #     plt.title("BERT-F1: {:.3f}".format(F1), fontsize=10)
     if fname != "":
         print("Saved figure to file: ", fname+".png")
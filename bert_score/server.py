@@ -0,0 +1,248 @@
+import json
+import asyncio
+import torch
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import bert_cos_score_idf, bert_types
+from .export import load_exported_encoder, backends
+from .score import load_bert
+
+__all__ = ['ScoringServer']
+
+_reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class ScoringServer(object):
+    """
+    Local HTTP server that keeps a BERT model resident and coalesces
+    concurrent requests into shared encoder batches.
+
+    Endpoints:
+        - `POST /score` with a JSON body `{"cands": [...], "refs": [...]}`
+          returns `{"P": [...], "R": [...], "F1": [...]}`, one score per pair.
+        - `GET /metrics` returns queue-depth and batch-fill statistics.
+
+    Scores are computed without idf weighting, as idf needs the full
+    reference corpus.
+
+    Args:
+        - :param: `bert` (str): bert specification
+        - :param: `num_layers` (int): the layer of representation to use
+        - :param: `batch_size` (int): number of pairs that closes a batch
+        - :param: `max_latency` (float): seconds a request may wait for
+                  other requests to join its batch
+        - :param: `backend` (str): 'eager', 'torchscript' or 'onnx'
+        - :param: `verbose` (bool): turn on intermediate status update
+        - :param: `tokenizer` : a BERT tokenizer corresponds to `model`, to
+                  serve an already loaded model
+        - :param: `model` : a truncated BERT model, loaded from `bert` and
+                  `num_layers` if not given
+    """
+
+    def __init__(self, bert="bert-base-multilingual-cased", num_layers=8,
+                 batch_size=64, max_latency=0.01, backend='eager', verbose=False,
+                 tokenizer=None, model=None):
+        assert bert in bert_types and bert != 'facebook-XLM'
+        assert backend in backends
+
+        self.bert = bert
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.verbose = verbose
+        # exported encoders are for CPU inference
+        self.device = 'cuda' if torch.cuda.is_available() and backend == 'eager' else 'cpu'
+
+        if model is None:
+            if verbose:
+                print('loading BERT model...')
+            tokenizer, model = load_bert(bert, num_layers, self.device)
+            if backend != 'eager':
+                model = load_exported_encoder(model, bert, num_layers, backend=backend)
+        self.tokenizer, self.model = tokenizer, model
+
+        self.idf_dict = defaultdict(lambda: 1.)
+        # set idf for [SEP] and [CLS] to 0
+        self.idf_dict[101] = 0
+        self.idf_dict[102] = 0
+
+        # a single worker keeps one batch on the model at a time while
+        # new requests queue up for the next one
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue = None
+        self._batcher = None
+        self.pending_pairs = 0
+        self.stats = {'requests': 0, 'pairs': 0, 'batches': 0, 'errors': 0,
+                      'batch_fill_sum': 0., 'last_batch_pairs': 0}
+
+    def metrics(self):
+        batches = self.stats['batches']
+        return {
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'pending_pairs': self.pending_pairs,
+            'requests': self.stats['requests'],
+            'pairs': self.stats['pairs'],
+            'batches': batches,
+            'errors': self.stats['errors'],
+            'last_batch_pairs': self.stats['last_batch_pairs'],
+            'mean_batch_pairs': self.stats['pairs'] / batches if batches else 0.,
+            'mean_batch_fill': self.stats['batch_fill_sum'] / batches if batches else 0.,
+        }
+
+    def _score(self, cands, refs):
+        preds = bert_cos_score_idf(self.model, refs, cands, None, None, self.tokenizer,
+                                   self.idf_dict, self.bert, device=self.device,
+                                   batch_size=self.batch_size)
+        return preds.tolist()
+
+    async def score(self, cands, refs):
+        """
+        Queue pairs for scoring and wait for their (P, R, F1) rows.
+        """
+        assert len(cands) == len(refs)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending_pairs += len(cands)
+        self.stats['requests'] += 1
+        await self.queue.put((cands, refs, future, loop.time()))
+        return await future
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            num_pairs = len(batch[0][0])
+            # the window opens when the oldest request arrived, so requests
+            # that queued behind a running batch do not wait again
+            deadline = batch[0][3] + self.max_latency
+
+            # take queued requests, then wait for more until the batch is
+            # full or the window closes
+            while num_pairs < self.batch_size:
+                timeout = deadline - loop.time()
+                if not self.queue.empty():
+                    item = self.queue.get_nowait()
+                elif timeout > 0:
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    break
+                batch.append(item)
+                num_pairs += len(item[0])
+
+            self.pending_pairs -= num_pairs
+            cands = [c for item in batch for c in item[0]]
+            refs = [r for item in batch for r in item[1]]
+
+            try:
+                preds = await loop.run_in_executor(self.executor, self._score, cands, refs)
+            except Exception as e:
+                self.stats['errors'] += 1
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.stats['batches'] += 1
+            self.stats['pairs'] += num_pairs
+            self.stats['last_batch_pairs'] = num_pairs
+            self.stats['batch_fill_sum'] += min(num_pairs / self.batch_size, 1.)
+            if self.verbose:
+                print('scored {} pairs from {} requests'.format(num_pairs, len(batch)))
+
+            start = 0
+            for item_cands, _, future, _ in batch:
+                end = start + len(item_cands)
+                if not future.done():
+                    future.set_result(preds[start:end])
+                start = end
+
+    async def _dispatch(self, method, path, body):
+        if path == '/metrics':
+            if method != 'GET':
+                return 405, {'error': 'use GET'}
+            return 200, self.metrics()
+        if path != '/score':
+            return 404, {'error': 'unknown path {}'.format(path)}
+        if method != 'POST':
+            return 405, {'error': 'use POST'}
+
+        try:
+            request = json.loads(body.decode('utf-8'))
+            cands, refs = request['cands'], request['refs']
+        except (ValueError, KeyError, TypeError):
+            return 400, {'error': 'expected a JSON object with "cands" and "refs" lists'}
+        if not isinstance(cands, list) or not isinstance(refs, list) or len(cands) != len(refs):
+            return 400, {'error': '"cands" and "refs" must be lists of the same length'}
+        if not all(isinstance(s, str) for s in cands + refs):
+            return 400, {'error': '"cands" and "refs" must contain strings'}
+        if len(cands) == 0:
+            return 200, {'P': [], 'R': [], 'F1': []}
+
+        try:
+            preds = await self.score(cands, refs)
+        except Exception as e:
+            return 500, {'error': str(e)}
+        P, R, F1 = zip(*preds)
+        return 200, {'P': list(P), 'R': list(R), 'F1': list(F1)}
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+        except (ValueError, asyncio.IncompleteReadError):
+            status, payload = 400, {'error': 'malformed HTTP request'}
+        else:
+            status, payload = await self._dispatch(method, path.split('?', 1)[0], body)
+
+        data = json.dumps(payload).encode('utf-8')
+        writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n'
+                     'Content-Length: {}\r\nConnection: close\r\n\r\n'
+                     .format(status, _reasons[status], len(data)).encode('latin-1') + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8000):
+        """
+        Start serving on `host`:`port` and return the `asyncio` server.
+        """
+        self.queue = asyncio.Queue()
+        self._batcher = asyncio.create_task(self._batch_loop())
+        return await asyncio.start_server(self._handle, host, port)
+
+    def close(self):
+        """
+        Stop the batching task and the model worker.
+        """
+        if self._batcher is not None:
+            self._batcher.cancel()
+            self._batcher = None
+        self.executor.shutdown()
+
+    async def _serve(self, host, port):
+        server = await self.start(host, port)
+        if self.verbose:
+            print('serving BERTScore on http://{}:{}'.format(host, port))
+        async with server:
+            await server.serve_forever()
+
+    def serve_forever(self, host='127.0.0.1', port=8000):
+        try:
+            asyncio.run(self._serve(host, port))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
@@ -0,0 +1,117 @@
+import numpy as np
+import torch
+
+__all__ = ['paired_bootstrap', 'bootstrap_significance']
+
+
+def _as_array(scores):
+    if isinstance(scores, torch.Tensor):
+        scores = scores.cpu().numpy()
+    scores = np.asarray(scores, dtype=np.float64)
+    assert scores.ndim == 2, "expected a (num_systems, num_segments) array"
+    return scores
+
+
+def _bootstrap_means(scores, n_samples, sample_size, chunk_size, seed):
+    scores = _as_array(scores)
+    num_systems, num_segments = scores.shape
+    if sample_size is None:
+        sample_size = num_segments
+    if chunk_size is None:
+        # a chunk holds about four chunk_size x N arrays of 8-byte entries
+        # (indices, offset indices, counts and their float copy), so 2**22
+        # entries per array peak at roughly 128 MiB
+        chunk_size = max(1, 2**22 // max(num_segments, sample_size))
+    rng = np.random.RandomState(seed)
+
+    samples = np.empty((num_systems, n_samples), dtype=np.float64)
+    for start in range(0, n_samples, chunk_size):
+        end = min(start + chunk_size, n_samples)
+        idx = rng.randint(0, num_segments, size=(end - start, sample_size))
+        # turn each row of indices into per-segment draw counts so that the
+        # resampled means of all systems are a single matrix product
+        offsets = np.arange(end - start)[:, None] * num_segments
+        counts = np.bincount((idx + offsets).ravel(),
+                             minlength=(end - start) * num_segments)
+        counts = counts.reshape(end - start, num_segments)
+        samples[:, start:end] = scores.dot(counts.T) / sample_size
+    return samples
+
+
+def _summarize(scores, samples, alpha):
+    ci = np.percentile(samples, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=1).T
+    wins = (samples[:, None, :] > samples[None, :, :]).mean(axis=-1)
+    return {
+        'mean': _as_array(scores).mean(axis=1),
+        'ci': ci,
+        'p_value': 1. - wins,
+        'samples': samples,
+    }
+
+
+def paired_bootstrap(scores, n_samples=1000, sample_size=None, alpha=0.05,
+                     chunk_size=None, seed=None):
+    """
+    Paired bootstrap resampling over segment-level scores.
+
+    Every resample draws one set of segment indices that is shared by all
+    systems, so systems are always compared on the same segments. Resamples
+    are drawn as an index matrix in chunks of `chunk_size` rows to bound
+    memory.
+
+    Returns a dict with
+        - `mean` (S,): mean score of each system over all segments
+        - `ci` (S, 2): (1 - `alpha`) percentile confidence interval
+        - `p_value` (S, S): `p_value[i, j]` is the fraction of resamples in
+          which system i does not score higher than system j, i.e. the
+          p-value of "system i is better than system j"
+        - `samples` (S, n_samples): the resampled means
+
+    Args:
+        - :param: `scores` (torch.Tensor or np.ndarray): SxN segment scores of
+                  S systems on the same N segments
+        - :param: `n_samples` (int): number of bootstrap resamples
+        - :param: `sample_size` (int): segments drawn per resample
+                  (default: N)
+        - :param: `alpha` (float): significance level of the intervals
+        - :param: `chunk_size` (int): resamples evaluated at once
+                  (default: sized for a peak of roughly 128 MiB)
+        - :param: `seed` (int): random seed
+    """
+    samples = _bootstrap_means(scores, n_samples, sample_size, chunk_size, seed)
+    return _summarize(scores, samples, alpha)
+
+
+def bootstrap_significance(all_preds, n_samples=1000, sample_size=None, alpha=0.05,
+                           chunk_size=None, seed=None):
+    """
+    Paired bootstrap test of BERTScore P, R and F1 for two or more systems
+    scored against the same references.
+
+    Returns a dict mapping 'P', 'R' and 'F1' to the output of
+    `paired_bootstrap`. The three metrics share the same resamples.
+
+    Args:
+        - :param: `all_preds` (list of tuple): one (P, R, F1) tuple per
+                  system, as returned by `score`
+        - :param: `n_samples` (int): number of bootstrap resamples
+        - :param: `sample_size` (int): segments drawn per resample
+        - :param: `alpha` (float): significance level of the intervals
+        - :param: `chunk_size` (int): resamples evaluated at once
+                  (default: sized for a peak of roughly 128 MiB)
+        - :param: `seed` (int): random seed
+    """
+    assert len(all_preds) >= 2, "need at least two systems to compare"
+    metrics = ['P', 'R', 'F1']
+    # (metric, system, segment) -> (metric * system, segment)
+    scores = torch.stack([torch.stack([preds[m] for preds in all_preds])
+                          for m in range(len(metrics))])
+    num_systems = scores.size(1)
+    samples = _bootstrap_means(scores.view(-1, scores.size(-1)), n_samples,
+                               sample_size, chunk_size, seed)
+
+    results = {}
+    for m, name in enumerate(metrics):
+        rows = slice(m * num_systems, (m + 1) * num_systems)
+        results[name] = _summarize(scores[m], samples[rows], alpha)
+    return results
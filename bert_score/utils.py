@@ -31,7 +31,6 @@ def padding(arr, pad_token, dtype=torch.long):
     padded = torch.ones(len(arr), max_len, dtype=dtype) * pad_token
     mask = torch.zeros(len(arr), max_len, dtype=torch.long)
     for i, a in enumerate(arr):
-        print(i, a)
         padded[i, :lens[i]] = torch.tensor(a, dtype=dtype)
         mask[i, :lens[i]] = 1
     
@@ -141,11 +140,6 @@ def collate_idf(arr, tokenizer, numericalize, idf_dict,
     else:
         pad_token = numericalize([pad])[0]
 
-    print('*****')
-    print(arr)
-    print('idf_dict', idf_dict)
-    print('idf_weights', idf_weights)
-    print('*****')
     padded, lens, mask = padding(arr, pad_token, dtype=torch.long)
     padded_idf, _, _ = padding(idf_weights, pad_token, dtype=torch.float)
 
@@ -157,7 +151,7 @@ def collate_idf(arr, tokenizer, numericalize, idf_dict,
 
 
 def get_bert_embedding(all_sens, model, tokenizer, idf_dict,
-                       batch_size=-1, device='cuda:0'):
+                       batch_size=-1, device='cuda:0', tokenize=None):
     """
     Compute BERT embedding in batches.
     Args:
@@ -167,10 +161,15 @@ def get_bert_embedding(all_sens, model, tokenizer, idf_dict,
         - :param: `idf_dict` (dict) : mapping a word piece index to its
                                inverse document frequency
         - :param: `device` (str): device to use, e.g. 'cpu' or 'cuda'
+        - :param: `tokenize` : a function that takes an element of `all_sens`
+                  and returns its word pieces (default: `tokenizer.tokenize`),
+                  e.g. `list` for sentences that are already tokenized
     """
+    if tokenize is None:
+        tokenize = tokenizer.tokenize
 
     padded_sens, padded_idf, lens, mask = collate_idf(all_sens,
-                                                      tokenizer.tokenize, tokenizer.convert_tokens_to_ids,
+                                                      tokenize, tokenizer.convert_tokens_to_ids,
                                                       idf_dict,
                                                       device=device)
 
@@ -269,8 +268,130 @@ def greedy_cos_idf(ref_embedding, ref_lens, ref_masks, ref_idf,
     return P, R, F
 
 
+def _is_oom_error(e):
+    return isinstance(e, MemoryError) or \
+        (isinstance(e, RuntimeError) and 'out of memory' in str(e))
+
+
+def _cuda_free_memory(device):
+    """
+    Bytes a new batch can still allocate on `device`: memory free on the
+    GPU, as seen by every process, plus memory cached by our allocator.
+    """
+    allocated = torch.cuda.memory_allocated(device)
+    if hasattr(torch.cuda, 'mem_get_info'):
+        free, _ = torch.cuda.mem_get_info(device)
+        return free + torch.cuda.memory_reserved(device) - allocated
+    # older PyTorch releases cannot see other processes
+    total = torch.cuda.get_device_properties(torch.device(device)).total_memory
+    return total - allocated
+
+
+def _adaptive_batches(lens, score_batch, device='cuda:0', mem_budget=None,
+                      init_tokens=4096, max_tokens=65536, patience=10, verbose=False):
+    """
+    Run `score_batch` over sentence pairs with batches sized from a budget of
+    padded tokens instead of a fixed sentence count.
+
+    Pairs are processed from shortest to longest. On CUDA the peak memory of
+    the last batch gives a per-token cost, and the next budget is the memory
+    currently free (capped by `mem_budget`) divided by that cost; without
+    CUDA the budget doubles after each successful batch up to `max_tokens`.
+    A batch that runs out of memory is split in half and retried, and the
+    budget stays below the size that failed until `patience` batches in a
+    row have succeeded.
+
+    Returns the concatenated outputs of `score_batch` in the original order.
+
+    Args:
+        - :param: `lens` (list of int): token length of each pair
+        - :param: `score_batch` : a function mapping a list of pair indices
+                  to a tensor with one row per pair
+        - :param: `device` (str): device to use, e.g. 'cpu' or 'cuda'
+        - :param: `mem_budget` (int): largest number of bytes a batch may
+                  use on CUDA (default: 90% of the free memory)
+        - :param: `init_tokens` (int): padded tokens in the first batch
+        - :param: `max_tokens` (int): largest budget without CUDA statistics
+        - :param: `patience` (int): successful batches before the budget may
+                  grow past a size that ran out of memory
+        - :param: `verbose` (bool): turn on intermediate status update
+    """
+    use_cuda = torch.cuda.is_available() and str(device).startswith('cuda')
+    if mem_budget is not None and not use_cuda:
+        raise ValueError('mem_budget needs a CUDA device, on CPU the batch size '
+                         'grows up to {} padded tokens'.format(max_tokens))
+    if use_cuda:
+        # renamed in newer PyTorch releases
+        reset_peak = getattr(torch.cuda, 'reset_peak_memory_stats', None) or \
+            torch.cuda.reset_max_memory_allocated
+
+    order = sorted(range(len(lens)), key=lambda i: lens[i])
+    preds = [None] * len(lens)
+    token_budget = init_tokens
+    ceiling = None
+    successes = 0
+
+    pbar = tqdm(total=len(lens)) if verbose else None
+    pos = 0
+    while pos < len(order):
+        # grow the batch while its padded size fits the budget
+        end = pos + 1
+        while end < len(order) and (end + 1 - pos) * lens[order[end]] <= token_budget:
+            end += 1
+        idx = order[pos:end]
+        num_tokens = len(idx) * lens[order[end - 1]]
+
+        oom = False
+        try:
+            if use_cuda:
+                reset_peak(device)
+                base = torch.cuda.memory_allocated(device)
+            batch_preds = score_batch(idx)
+        except Exception as e:
+            if not _is_oom_error(e) or len(idx) == 1:
+                raise
+            oom = True
+
+        if oom:
+            # the traceback holding the failed activations is gone by now
+            if use_cuda:
+                torch.cuda.empty_cache()
+            ceiling = num_tokens
+            successes = 0
+            token_budget = (len(idx) // 2) * lens[order[end - 1]]
+            if verbose:
+                print('out of memory with {} pairs, retrying with {}'.format(len(idx), len(idx) // 2))
+            continue
+
+        for i, p in zip(idx, batch_preds):
+            preds[i] = p
+        pos = end
+        if pbar is not None:
+            pbar.update(len(idx))
+
+        if use_cuda:
+            per_token = (torch.cuda.max_memory_allocated(device) - base) / num_tokens
+            budget = 0.9 * _cuda_free_memory(device)
+            if mem_budget is not None:
+                budget = min(budget, mem_budget)
+            token_budget = int(budget / per_token) if per_token > 0 else token_budget * 2
+        else:
+            token_budget = min(token_budget * 2, max_tokens)
+
+        if ceiling is not None:
+            successes += 1
+            if successes >= patience:
+                ceiling = None
+            else:
+                token_budget = min(token_budget, ceiling - 1)
+
+    if pbar is not None:
+        pbar.close()
+    return torch.stack(preds)
+
+
 def bert_cos_score_idf(model, refs, hyps, refs_lang, hyps_lang, tokenizer, idf_dict, bert,
-                       verbose=False, batch_size=256, device='cuda:0'):
+                       verbose=False, batch_size=256, device='cuda:0', mem_budget=None):
     """
     Compute BERTScore.
     Args:
@@ -281,25 +402,26 @@ def bert_cos_score_idf(model, refs, hyps, refs_lang, hyps_lang, tokenizer, idf_d
         - :param: `idf_dict` : a dictionary mapping a word piece index to its
                                inverse document frequency
         - :param: `verbose` (bool): turn on intermediate status update
-        - :param: `batch_size` (int): bert score processing batch size
+        - :param: `batch_size` (int or 'auto'): bert score processing batch
+                               size, 'auto' picks it from available memory
         - :param: `device` (str): device to use, e.g. 'cpu' or 'cuda'
+        - :param: `mem_budget` (int): largest number of bytes a batch may
+                               use with `batch_size='auto'`, CUDA only
     """
 
+    if mem_budget is not None and batch_size != 'auto':
+        raise ValueError("mem_budget only applies to batch_size='auto'")
+
     if bert == 'facebook-XLM':
         model, params, dico, bpe = xlm_emb.load_facebook_xml_model()
 
-    preds = []
-    iter_range = range(0, len(refs), batch_size)
-    if verbose: iter_range = tqdm(iter_range)
-
-    for batch_start in iter_range:
-
-        batch_refs = refs[batch_start:batch_start+batch_size]
-        batch_hyps = hyps[batch_start:batch_start+batch_size]
+    def score_batch(idx):
+        batch_refs = [refs[i] for i in idx]
+        batch_hyps = [hyps[i] for i in idx]
 
         if bert == 'facebook-XLM':
-            batch_lang_refs = refs_lang[batch_start:batch_start+batch_size]
-            batch_lang_hyps = hyps_lang[batch_start:batch_start+batch_size]
+            batch_lang_refs = [refs_lang[i] for i in idx]
+            batch_lang_hyps = [hyps_lang[i] for i in idx]
 
             # get bert embeddings
 
@@ -317,22 +439,26 @@ def bert_cos_score_idf(model, refs, hyps, refs_lang, hyps_lang, tokenizer, idf_d
             hyp_stats = get_bert_embedding(batch_hyps, model, tokenizer, idf_dict,
                                         device=device)
 
-        print('***************************')
-        print('\nref_stats')
-        print('ref_stats[0].size()', ref_stats[0].size())
-        print('ref_stats[1]', ref_stats[1].size(), ref_stats[1])
-        print('ref_stats[2]', ref_stats[2].size(), ref_stats[2])
-        print('ref_stats[3]', ref_stats[3].size(), ref_stats[3])
+        P, R, F1 = greedy_cos_idf(*ref_stats, *hyp_stats)
+        return torch.stack((P, R, F1), dim=1).cpu()
 
-        print('\nhyp_stats')
-        print('hyp_stats[0].size()', hyp_stats[0].size())
-        print('hyp_stats[1]', hyp_stats[1].size(), hyp_stats[1])
-        print('hyp_stats[2]', hyp_stats[2].size(), hyp_stats[2])
-        print('hyp_stats[3]', hyp_stats[3].size(), hyp_stats[3])
-        print('***************************')
+    if batch_size == 'auto':
+        # [CLS] and [SEP] / <s> and </s> are added to every sentence
+        if bert == 'facebook-XLM':
+            length = lambda a: len(a.split()) + 2
+        else:
+            length = lambda a: len(tokenizer.tokenize(a)) + 2
+        lens = [max(length(r), length(h)) for r, h in zip(refs, hyps)]
+        return _adaptive_batches(lens, score_batch, device=device, mem_budget=mem_budget,
+                                 verbose=verbose)
 
-        P, R, F1 = greedy_cos_idf(*ref_stats, *hyp_stats)
-        preds.append(torch.stack((P, R, F1), dim=1).cpu())
+    preds = []
+    iter_range = range(0, len(refs), batch_size)
+    if verbose: iter_range = tqdm(iter_range)
+
+    for batch_start in iter_range:
+        idx = range(batch_start, min(batch_start+batch_size, len(refs)))
+        preds.append(score_batch(idx))
 
     preds = torch.cat(preds, dim=0)
     return preds
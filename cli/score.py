@@ -10,6 +10,10 @@ import bert_score
 
 VERSION=bert_score.__version__
 
+def batch_size_type(value):
+    return value if value == 'auto' else int(value)
+
+
 def main():
     torch.multiprocessing.set_sharing_strategy('file_system')
 
@@ -17,42 +21,78 @@ def main():
     parser.add_argument('--bert', default='bert-base-multilingual-cased',
                         choices=bert_score.bert_types, help='BERT model name (default: bert-base-uncased)')
     parser.add_argument('-l', '--num_layers', type=int, default=8, help='use first N layer in BERT (default: 8)')
-    parser.add_argument('-b', '--batch_size', type=int, default=64, help='batch size (default: 64)')
+    parser.add_argument('-b', '--batch_size', type=batch_size_type, default=64,
+                        help='batch size, or auto to size batches from available memory (default: 64)')
+    parser.add_argument('--mem_budget', type=int, default=None,
+                        help='largest GPU memory in MiB a batch may use with --batch_size auto, '
+                             'CUDA only (default: 90%% of free memory)')
+    parser.add_argument('--backend', default='eager', choices=bert_score.backends,
+                        help='run the encoder eagerly or through a cached export (default: eager)')
     parser.add_argument('--no_idf', action='store_true', help='BERT Score without IDF scaling')
     parser.add_argument('-s', '--seg_level', action='store_true', help='show individual score of each pair')
     parser.add_argument('-v', '--verbose', action='store_true', help='increase output verbosity')
     parser.add_argument('-r', '--ref', type=str, required=True, help='reference file path or a string')
-    parser.add_argument('-c', '--cand', type=str, required=True, help='candidate (system outputs) file path or a string')
+    parser.add_argument('-c', '--cand', type=str, nargs='+', required=True,
+                        help='candidate (system outputs) file path or a string, several files compare systems')
+    parser.add_argument('--bootstrap', type=int, default=0,
+                        help='number of paired bootstrap resamples to compare systems (default: 0, off)')
+    parser.add_argument('--alpha', type=float, default=0.05, help='bootstrap significance level (default: 0.05)')
+    parser.add_argument('--seed', type=int, default=None, help='bootstrap random seed')
 
     args = parser.parse_args()
+    if args.bootstrap > 0 and len(args.cand) < 2:
+        parser.error('--bootstrap needs at least two candidate files to compare')
+    mem_budget = args.mem_budget * 2**20 if args.mem_budget is not None else None
 
-    if os.path.isfile(args.cand) and os.path.isfile(args.ref):
-        with open(args.cand) as f:
-            cands = [line.strip() for line in f]
+    if all(os.path.isfile(c) for c in args.cand) and os.path.isfile(args.ref):
+        all_cands = []
+        for cand in args.cand:
+            with open(cand) as f:
+                all_cands.append([line.strip() for line in f])
 
         with open(args.ref) as f:
             refs = [line.strip() for line in f]
     else:
-        cands = [args.cand]
+        assert len(args.cand) == 1, "only a single candidate string can be scored against a reference string"
+        all_cands = [args.cand]
         refs = [args.ref]
         assert args.no_idf, "do not suuport idf fold for a single pair of sentences"
 
-    assert len(cands) == len(refs)
-
-    all_preds = bert_score.score(cands, refs, bert=args.bert, num_layers=args.num_layers, verbose=args.verbose,
-                                 no_idf=args.no_idf, batch_size=args.batch_size)
-    avg_scores = [s.mean(dim=0) for s in all_preds]
-    P = avg_scores[0].cpu().item()
-    R = avg_scores[1].cpu().item()
-    F1 = avg_scores[2].cpu().item()
-    msg = '{}_L{}{}_version={} BERT-P: {:.6f} BERT-R: {:.6f} BERT-F1: {:.6f}'.format(
-        args.bert, args.num_layers, '_no-idf' if args.no_idf else '', VERSION, P, R, F1)
-    print(msg)
-    if args.seg_level:
-        ps, rs, fs = all_preds
-        for p, r, f in zip(ps, rs, fs):
-            print('{:.6f}\t{:.6f}\t{:.6f}'.format(p, r, f))
+    for cands in all_cands:
+        assert len(cands) == len(refs)
+
+    all_system_preds = bert_score.score_systems(all_cands, refs, bert=args.bert, num_layers=args.num_layers,
+                                                verbose=args.verbose, no_idf=args.no_idf,
+                                                batch_size=args.batch_size, backend=args.backend,
+                                                mem_budget=mem_budget)
+    for name, all_preds in zip(args.cand, all_system_preds):
+        avg_scores = [s.mean(dim=0) for s in all_preds]
+        P = avg_scores[0].cpu().item()
+        R = avg_scores[1].cpu().item()
+        F1 = avg_scores[2].cpu().item()
+        msg = '{}_L{}{}_version={} BERT-P: {:.6f} BERT-R: {:.6f} BERT-F1: {:.6f}'.format(
+            args.bert, args.num_layers, '_no-idf' if args.no_idf else '', VERSION, P, R, F1)
+        if len(all_cands) > 1:
+            msg = '{}: {}'.format(name, msg)
+        print(msg)
+        if args.seg_level:
+            ps, rs, fs = all_preds
+            for p, r, f in zip(ps, rs, fs):
+                print('{:.6f}\t{:.6f}\t{:.6f}'.format(p, r, f))
 
+    if args.bootstrap > 0:
+        results = bert_score.bootstrap_significance(all_system_preds, n_samples=args.bootstrap,
+                                                    alpha=args.alpha, seed=args.seed)
+        level = 100 * (1 - args.alpha)
+        for metric, res in results.items():
+            print('paired bootstrap BERT-{} ({} resamples, {:g}% CI)'.format(metric, args.bootstrap, level))
+            print('a small p for "A > B" means A is significantly better than B')
+            for i, name in enumerate(args.cand):
+                print('{}\t{:.6f}\t[{:.6f}, {:.6f}]'.format(name, res['mean'][i], *res['ci'][i]))
+            for i, name_i in enumerate(args.cand):
+                for j, name_j in enumerate(args.cand):
+                    if i != j:
+                        print('{} > {}: p = {:.4f}'.format(name_i, name_j, res['p_value'][i, j]))
 
 if __name__ == "__main__":
     main()
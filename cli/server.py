@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+import argparse
+import torch
+
+import bert_score
+from bert_score.server import ScoringServer
+
+def main():
+    torch.multiprocessing.set_sharing_strategy('file_system')
+
+    parser = argparse.ArgumentParser('Serve BERTScore over HTTP')
+    parser.add_argument('--bert', default='bert-base-multilingual-cased',
+                        choices=[b for b in bert_score.bert_types if b != 'facebook-XLM'],
+                        help='BERT model name (default: bert-base-multilingual-cased)')
+    parser.add_argument('-l', '--num_layers', type=int, default=8, help='use first N layer in BERT (default: 8)')
+    parser.add_argument('-b', '--batch_size', type=int, default=64,
+                        help='number of pairs that closes a batch (default: 64)')
+    parser.add_argument('-w', '--max_latency', type=float, default=10.,
+                        help='milliseconds a request waits for others to join its batch (default: 10)')
+    parser.add_argument('--backend', default='eager', choices=bert_score.backends,
+                        help='run the encoder eagerly or through a cached export (default: eager)')
+    parser.add_argument('--host', default='127.0.0.1', help='address to bind (default: 127.0.0.1)')
+    parser.add_argument('-p', '--port', type=int, default=8000, help='port to bind (default: 8000)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='increase output verbosity')
+
+    args = parser.parse_args()
+
+    server = ScoringServer(bert=args.bert, num_layers=args.num_layers, batch_size=args.batch_size,
+                           max_latency=args.max_latency / 1000., backend=args.backend,
+                           verbose=args.verbose)
+    server.serve_forever(host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import os
 import time
 import argparse
 import torch
@@ -13,20 +14,46 @@ def main():
     parser = argparse.ArgumentParser('Calculate BERTScore')
     parser.add_argument('--bert', default='bert-base-multilingual-cased',
                         choices=bert_score.bert_types, help='BERT model name (default: bert-base-uncased)')
-    parser.add_argument('-l', '--num_layers', default=8, help='use first N layer in BERT (default: 8)')
+    parser.add_argument('-l', '--num_layers', type=int, default=8, help='use first N layer in BERT (default: 8)')
     parser.add_argument('-v', '--verbose', action='store_true', help='increase output verbosity')
-    parser.add_argument('-r', '--ref', required=True, help='reference sentence')
-    parser.add_argument('-c', '--cand', required=True,help='candidate sentence')
+    parser.add_argument('-r', '--ref', required=True, help='reference file path or a sentence')
+    parser.add_argument('-c', '--cand', required=True,help='candidate file path or a sentence')
     parser.add_argument('-o', '--output_file_name', default='',help='output file name')
+    parser.add_argument('-b', '--batch_size', type=int, default=64,
+                        help='batch size when reading pairs from files (default: 64)')
+    parser.add_argument('-d', '--output_dir', default='.',
+                        help='output directory when reading pairs from files (default: .)')
+    parser.add_argument('--no_render', action='store_true',
+                        help='only export similarity matrices, do not render figures')
+    parser.add_argument('-a', '--annotate', default=None, choices=bert_score.annotate_modes,
+                        help='heatmap cells to print scores in (default: all for a sentence pair, '
+                             'none when reading pairs from files)')
+    parser.add_argument('-n', '--nthreads', type=int, default=4,
+                        help='number of processes used to render figures (default: 4)')
 
     args = parser.parse_args()
 
-    cand = args.cand
-    ref = args.ref
-    fname = args.output_file_name
-    bert_score.plot_example(cand, ref, verbose=args.verbose,
-                            bert=args.bert, num_layers=args.num_layers,
-                            fname = fname)
+    if os.path.isfile(args.cand) and os.path.isfile(args.ref):
+        with open(args.cand) as f:
+            cands = [line.strip() for line in f]
+
+        with open(args.ref) as f:
+            refs = [line.strip() for line in f]
+
+        assert len(cands) == len(refs)
+
+        bert_score.plot_examples(cands, refs, verbose=args.verbose,
+                                 bert=args.bert, num_layers=args.num_layers,
+                                 batch_size=args.batch_size, output_dir=args.output_dir,
+                                 render=not args.no_render, annotate=args.annotate or 'none',
+                                 nthreads=args.nthreads)
+    else:
+        cand = args.cand
+        ref = args.ref
+        fname = args.output_file_name
+        bert_score.plot_example(cand, ref, verbose=args.verbose,
+                                bert=args.bert, num_layers=args.num_layers,
+                                fname = fname, annotate=args.annotate or 'all')
 
 
 if __name__ == "__main__":
@@ -24,6 +24,7 @@ setup(
         'console_scripts': [
             "bert-score=cli.score:main",
             "bert-score-show=cli.visualize:main",
+            "bert-score-server=cli.server:main",
         ]
     },
     # python_requires='>=3.5.0',
@@ -0,0 +1,63 @@
+import os
+import pytest
+import torch
+from pytorch_pretrained_bert import BertConfig, BertModel
+
+from bert_score import export_encoder, load_exported_encoder, check_parity
+from bert_score.export import _TruncatedEncoder
+
+shapes = [(1, 1), (1, 5), (2, 8), (3, 17), (8, 64)]
+
+
+def tiny_bert(num_layers=2):
+    torch.manual_seed(0)
+    config = BertConfig(200, hidden_size=32, num_hidden_layers=3,
+                        num_attention_heads=4, intermediate_size=64)
+    model = BertModel(config)
+    model.eval()
+    model.encoder.layer = torch.nn.ModuleList(model.encoder.layer[:num_layers])
+    return model
+
+
+@pytest.fixture(params=['torchscript', 'onnx'])
+def backend(request):
+    if request.param == 'onnx':
+        pytest.importorskip('onnx')
+        pytest.importorskip('onnxruntime')
+    return request.param
+
+
+def test_parity(tmpdir, backend):
+    model = tiny_bert()
+    encoder = load_exported_encoder(model, 'tiny', 2, backend=backend, cache_dir=str(tmpdir))
+    check_parity(model, encoder, shapes=shapes)
+
+    eager = _TruncatedEncoder(model)
+    x = torch.randint(1, 200, (3, 9), dtype=torch.long)
+    mask = torch.ones_like(x)
+    mask[1, 4:] = 0
+    with torch.no_grad():
+        expected = eager(x, mask)
+    actual, _ = encoder(x, torch.zeros_like(x), attention_mask=mask)
+    assert actual.shape == (3, 9, 32)
+    assert torch.allclose(actual, expected, atol=1e-4)
+
+
+def test_cache(tmpdir, backend):
+    model = tiny_bert()
+    path = export_encoder(model, 'tiny', 2, backend=backend, cache_dir=str(tmpdir))
+    assert os.path.isfile(path)
+    assert torch.__version__ in os.path.basename(path)
+    mtime = os.path.getmtime(path)
+    assert export_encoder(model, 'tiny', 2, backend=backend, cache_dir=str(tmpdir)) == path
+    assert os.path.getmtime(path) == mtime
+
+
+def test_stale_cache_is_replaced(tmpdir, backend):
+    export_encoder(tiny_bert(), 'tiny', 2, backend=backend, cache_dir=str(tmpdir))
+    # different weights under the same cache name
+    model = tiny_bert()
+    with torch.no_grad():
+        model.embeddings.word_embeddings.weight.add_(1.)
+    encoder = load_exported_encoder(model, 'tiny', 2, backend=backend, cache_dir=str(tmpdir))
+    check_parity(model, encoder, shapes=shapes)
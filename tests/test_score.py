@@ -0,0 +1,81 @@
+import json
+import numpy as np
+import pytest
+import torch
+from pytorch_pretrained_bert import BertConfig, BertModel, BertTokenizer
+
+from bert_score import get_sim_matrices, save_sim_matrices
+
+words = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', 'the', 'a', 'cat', 'dog', 'sat',
+         'on', 'mat', 'hello', 'how', 'are', 'you', '##s', '##ing', 'run']
+
+cands = ['the cat sat', 'hello how are you', 'dogs', 'a dog running on the mat']
+refs = ['a cat sat on the mat', 'hello', 'the dog running', 'the cat']
+
+
+@pytest.fixture(scope='module')
+def bert(tmpdir_factory):
+    vocab = tmpdir_factory.mktemp('vocab').join('vocab.txt')
+    vocab.write('\n'.join(words) + '\n')
+    tokenizer = BertTokenizer(str(vocab))
+
+    torch.manual_seed(0)
+    config = BertConfig(len(words), hidden_size=32, num_hidden_layers=2,
+                        num_attention_heads=4, intermediate_size=64)
+    model = BertModel(config)
+    model.eval()
+    return tokenizer, model
+
+
+def test_batched_matches_single(bert):
+    tokenizer, model = bert
+    batched = get_sim_matrices(cands, refs, model, tokenizer, batch_size=3, device='cpu')
+    for i, (h, r) in enumerate(zip(cands, refs)):
+        single = get_sim_matrices([h], [r], model, tokenizer, device='cpu')[0]
+        assert batched[i]['h_tokens'] == single['h_tokens']
+        assert batched[i]['r_tokens'] == single['r_tokens']
+        np.testing.assert_allclose(batched[i]['sim'], single['sim'], atol=1e-5)
+        assert batched[i]['F'] == pytest.approx(single['F'], abs=1e-5)
+
+
+def test_special_tokens_removed(bert):
+    tokenizer, model = bert
+    for ex, h, r in zip(get_sim_matrices(cands, refs, model, tokenizer, device='cpu'), cands, refs):
+        assert ex['h_tokens'] == tokenizer.tokenize(h)
+        assert ex['r_tokens'] == tokenizer.tokenize(r)
+        assert ex['sim'].shape == (len(ex['h_tokens']), len(ex['r_tokens']))
+        assert ex['h_align'].shape == (len(ex['h_tokens']),)
+        assert ex['r_align'].shape == (len(ex['r_tokens']),)
+        np.testing.assert_array_equal(ex['h_align'], ex['sim'].argmax(1))
+        assert ex['P'] == pytest.approx(ex['sim'].max(1).mean(), abs=1e-6)
+
+
+def test_empty_candidate(bert):
+    tokenizer, model = bert
+    ex = get_sim_matrices([''], ['the cat sat'], model, tokenizer, device='cpu')[0]
+    assert ex['sim'].shape == (0, 3)
+    assert ex['h_align'].shape == (0,)
+    assert ex['P'] == ex['R'] == ex['F'] == 0.
+
+
+def test_save_sim_matrices(bert, tmpdir):
+    tokenizer, model = bert
+    examples = get_sim_matrices(cands, refs, model, tokenizer, device='cpu')
+    fname = str(tmpdir.join('sim'))
+    save_sim_matrices(examples, fname)
+
+    arrays = np.load(fname + '.npz')
+    assert sorted(arrays.files) == sorted(['P', 'R', 'F'] +
+                                          ['sim_{}'.format(i) for i in range(len(examples))])
+    with open(fname + '.json', encoding='utf-8') as f:
+        records = json.load(f)
+    assert len(records) == len(examples)
+
+    for i, (ex, record) in enumerate(zip(examples, records)):
+        np.testing.assert_array_equal(arrays['sim_{}'.format(i)], ex['sim'])
+        assert arrays['F'][i] == pytest.approx(ex['F'], abs=1e-6)
+        assert record['h_tokens'] == ex['h_tokens']
+        assert record['r_tokens'] == ex['r_tokens']
+        assert record['h_align'] == ex['h_align'].tolist()
+        assert record['r_align'] == ex['r_align'].tolist()
+        assert record['P'] == pytest.approx(ex['P'])
@@ -0,0 +1,121 @@
+import json
+import time
+import asyncio
+
+from bert_score.server import ScoringServer
+
+
+class StubServer(ScoringServer):
+    """Scores each pair as (cand, ref, 0) from integer strings, no model."""
+
+    def __init__(self, delay=0., **kwargs):
+        super(StubServer, self).__init__(bert='bert-base-uncased', tokenizer=object(),
+                                         model=object(), **kwargs)
+        self.delay = delay
+        self.calls = []
+        self.times = []
+
+    def _score(self, cands, refs):
+        start = time.perf_counter()
+        self.calls.append(len(cands))
+        time.sleep(self.delay)
+        self.times.append((start, time.perf_counter()))
+        return [[float(c), float(r), 0.] for c, r in zip(cands, refs)]
+
+
+def request(i, n=2):
+    cands = [str(10 * i + j) for j in range(n)]
+    refs = [str(-(10 * i + j)) for j in range(n)]
+    return cands, refs
+
+
+async def post(port, method, path, body=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    data = json.dumps(body).encode('utf-8') if body is not None else b''
+    writer.write('{} {} HTTP/1.1\r\nContent-Length: {}\r\n\r\n'.format(
+        method, path, len(data)).encode('latin-1') + data)
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(payload.decode('utf-8'))
+
+
+def run(server, coro):
+    async def main():
+        srv = await server.start(port=0)
+        try:
+            return await coro(srv.sockets[0].getsockname()[1])
+        finally:
+            srv.close()
+            server.close()
+    return asyncio.run(main())
+
+
+def test_coalescing_and_order():
+    server = StubServer(batch_size=8, max_latency=0.2)
+
+    async def go(port):
+        return await asyncio.gather(*[server.score(*request(i)) for i in range(5)])
+
+    results = run(server, go)
+    # four requests fill the first batch, the fifth goes alone
+    assert server.calls == [8, 2]
+    for i, rows in enumerate(results):
+        cands, refs = request(i)
+        assert rows == [[float(c), float(r), 0.] for c, r in zip(cands, refs)]
+
+
+def test_batch_size_closes_window():
+    server = StubServer(batch_size=4, max_latency=5.)
+
+    async def go(port):
+        start = time.perf_counter()
+        await asyncio.gather(*[server.score(*request(i)) for i in range(2)])
+        return time.perf_counter() - start
+
+    assert run(server, go) < 1.
+    assert server.calls == [4]
+
+
+def test_window_starts_on_arrival():
+    server = StubServer(batch_size=2, max_latency=0.3, delay=0.5)
+
+    async def go(port):
+        first = asyncio.ensure_future(server.score(*request(0)))
+        await asyncio.sleep(0.05)
+        # queued while the first batch runs, its window closes before that
+        await server.score(*request(1, n=1))
+        await first
+
+    run(server, go)
+    assert server.calls == [2, 1]
+    # the second batch does not open a new latency window
+    (_, first_end), (second_start, _) = server.times
+    assert second_start - first_end < server.max_latency
+
+
+def test_http_and_metrics():
+    server = StubServer(batch_size=4, max_latency=0.05)
+
+    async def go(port):
+        cands, refs = request(1)
+        responses = await asyncio.gather(
+            post(port, 'POST', '/score', {'cands': cands, 'refs': refs}),
+            post(port, 'POST', '/score', {'cands': cands, 'refs': refs}),
+            post(port, 'POST', '/score', {'cands': ['1']}),
+            post(port, 'GET', '/nowhere'))
+        metrics = await post(port, 'GET', '/metrics')
+        return responses, metrics
+
+    responses, (status, metrics) = run(server, go)
+    assert responses[0] == (200, {'P': [10., 11.], 'R': [-10., -11.], 'F1': [0., 0.]})
+    assert responses[1] == responses[0]
+    assert responses[2][0] == 400
+    assert responses[3][0] == 404
+    assert status == 200
+    assert metrics['requests'] == 2
+    assert metrics['pairs'] == 4
+    assert metrics['batches'] == 1
+    assert metrics['mean_batch_fill'] == 1.
+    assert metrics['queue_depth'] == 0
+    assert metrics['pending_pairs'] == 0
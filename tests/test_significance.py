@@ -0,0 +1,46 @@
+import numpy as np
+import torch
+
+from bert_score import paired_bootstrap, bootstrap_significance
+
+
+def test_ci_shape():
+    scores = np.random.RandomState(0).rand(3, 50)
+    out = paired_bootstrap(scores, n_samples=200, seed=0)
+    assert out['mean'].shape == (3,)
+    assert out['ci'].shape == (3, 2)
+    assert out['p_value'].shape == (3, 3)
+    assert out['samples'].shape == (3, 200)
+    assert (out['ci'][:, 0] <= out['ci'][:, 1]).all()
+
+
+def test_identical_systems():
+    scores = np.random.RandomState(0).rand(50)
+    out = paired_bootstrap(np.stack([scores, scores]), n_samples=200, seed=0)
+    assert out['p_value'][0, 1] == 1.
+    assert out['p_value'][1, 0] == 1.
+
+
+def test_dominant_system():
+    base = np.random.RandomState(0).rand(100)
+    out = paired_bootstrap(np.stack([base + 0.1, base]), n_samples=500, seed=0)
+    assert out['p_value'][0, 1] < 0.01
+    assert out['p_value'][1, 0] > 0.99
+
+
+def test_chunk_size_invariance():
+    scores = torch.rand(2, 37)
+    outs = [paired_bootstrap(scores, n_samples=100, chunk_size=c, seed=1)
+            for c in (1, 7, 100, None)]
+    for out in outs[1:]:
+        np.testing.assert_allclose(out['samples'], outs[0]['samples'], rtol=0, atol=1e-12)
+        np.testing.assert_array_equal(out['p_value'], outs[0]['p_value'])
+
+
+def test_bootstrap_significance():
+    P = torch.rand(40)
+    all_preds = [(P, P, P), (P - 0.1, P, P)]
+    results = bootstrap_significance(all_preds, n_samples=200, seed=0)
+    assert sorted(results) == ['F1', 'P', 'R']
+    assert results['P']['p_value'][0, 1] < 0.01
+    assert results['R']['p_value'][0, 1] == 1.
@@ -0,0 +1,91 @@
+import pytest
+import torch
+
+from bert_score.utils import _adaptive_batches
+
+
+def fake_scorer(lens, max_tokens=None, fail_once=None):
+    """Returns each pair's index and records the padded size of each batch."""
+    batches = []
+
+    def score_batch(idx):
+        num_tokens = len(idx) * max(lens[i] for i in idx)
+        if (max_tokens is not None and num_tokens > max_tokens) or \
+                (fail_once is not None and len(batches) == fail_once):
+            batches.append(None)
+            raise RuntimeError('CUDA out of memory. Tried to allocate 2.00 GiB')
+        batches.append(num_tokens)
+        return torch.tensor([[float(i)] * 3 for i in idx])
+    return score_batch, batches
+
+
+def test_order_is_restored():
+    lens = [5, 1, 9, 3, 3, 7, 2]
+    score_batch, _ = fake_scorer(lens)
+    preds = _adaptive_batches(lens, score_batch, device='cpu', init_tokens=8)
+    assert preds[:, 0].tolist() == list(range(len(lens)))
+
+
+def test_oom_splits_batch():
+    lens = [4] * 64
+    score_batch, batches = fake_scorer(lens, max_tokens=40)
+    preds = _adaptive_batches(lens, score_batch, device='cpu', init_tokens=256)
+    assert preds[:, 0].tolist() == list(range(64))
+    assert None in batches
+    assert max(b for b in batches if b is not None) <= 40
+
+
+def test_ceiling_expires():
+    lens = [1] * 400
+    score_batch, batches = fake_scorer(lens, fail_once=1)
+    _adaptive_batches(lens, score_batch, device='cpu', init_tokens=4, patience=3)
+    done = [b for b in batches if b is not None]
+    # the batch after the failure is capped, later ones grow past it again
+    assert done[1] < 8
+    assert max(done) > 8
+
+
+def test_oom_on_single_pair_raises():
+    score_batch, _ = fake_scorer([10], max_tokens=5)
+    with pytest.raises(RuntimeError):
+        _adaptive_batches([10], score_batch, device='cpu')
+
+
+def test_other_errors_propagate():
+    def score_batch(idx):
+        raise KeyError('boom')
+    with pytest.raises(KeyError):
+        _adaptive_batches([1, 2], score_batch, device='cpu')
+
+
+def test_mem_budget_needs_cuda(monkeypatch):
+    monkeypatch.setattr(torch.cuda, 'is_available', lambda: False)
+    with pytest.raises(ValueError):
+        _adaptive_batches([1], lambda idx: torch.zeros(1, 3), device='cpu', mem_budget=2**30)
+
+
+def test_cuda_budget_follows_free_memory(monkeypatch):
+    state = {'allocated': 0, 'peak': 0, 'free': 100000}
+    monkeypatch.setattr(torch.cuda, 'is_available', lambda: True)
+    monkeypatch.setattr(torch.cuda, 'memory_allocated', lambda device=None: state['allocated'])
+    monkeypatch.setattr(torch.cuda, 'memory_reserved', lambda device=None: 0)
+    monkeypatch.setattr(torch.cuda, 'max_memory_allocated', lambda device=None: state['peak'])
+    monkeypatch.setattr(torch.cuda, 'reset_peak_memory_stats', lambda device=None: None)
+    monkeypatch.setattr(torch.cuda, 'mem_get_info', lambda device=None: (state['free'], 10**9))
+
+    lens = [1] * 20000
+    sizes = []
+
+    def score_batch(idx):
+        sizes.append(len(idx))
+        # 10 bytes per padded token
+        state['peak'] = 10 * len(idx)
+        if len(sizes) == 3:
+            # another process takes most of the GPU
+            state['free'] = 10000
+        return torch.zeros(len(idx), 3)
+
+    _adaptive_batches(lens, score_batch, device='cuda:0', init_tokens=16)
+    assert sizes[0] == 16
+    assert sizes[1] == sizes[2] == 9000
+    assert sizes[3] == 900